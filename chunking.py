@@ -0,0 +1,60 @@
+import re
+
+# Places where a chunk may end, best first: paragraph break, line break,
+# end of a sentence, any whitespace. A match's end is where the cut goes.
+BOUNDARIES = [
+    re.compile(r"\n\s*\n"),
+    re.compile(r"\n"),
+    re.compile(r"[.!?]['\")\]]*\s"),
+    re.compile(r"\s"),
+]
+
+
+def _cut_point(text: str, lo: int, hi: int, near: int | None = None) -> int:
+    """
+    Where to cut `text`, somewhere in [lo, hi].
+
+    Uses the best kind of boundary that appears in that range: the last
+    one, or the one closest to `near` if given. With no boundary at all
+    it cuts at `near` (or `hi`), even mid-word.
+    """
+    for pattern in BOUNDARIES:
+        ends = [m.end() for m in pattern.finditer(text, 0, hi) if m.end() >= lo]
+        if ends:
+            if near is None:
+                return ends[-1]
+            return min(ends, key=lambda end: abs(end - near))
+    return hi if near is None else near
+
+
+def split_into_chunks(text: str, max_chars: int, min_chars: int | None = None) -> list[str]:
+    """
+    Split text into chunks of at most max_chars, on natural boundaries.
+
+    Each chunk ends at a paragraph break if there is one late enough in
+    it, otherwise at a line break, a sentence end or a space, so words are
+    only cut when a stretch of max_chars has no whitespace at all. Chunks
+    are at least min_chars long (default: a quarter of max_chars), except
+    when the whole text is shorter; a short tail is balanced with the
+    chunk before it instead of being sent on its own.
+    """
+    if min_chars is None:
+        min_chars = max_chars // 4
+
+    text = text.replace("\r\n", "\n").replace("\r", "\n").strip()
+    pieces = []
+
+    while len(text) > max_chars:
+        cut = _cut_point(text, min_chars, max_chars)
+        pieces.append(text[:cut])
+        text = text[cut:].lstrip()
+
+    if pieces and len(text) < min_chars:
+        # Split the last chunk + the short tail into two halves instead
+        text = pieces.pop() + text
+        cut = _cut_point(text, len(text) - max_chars, max_chars, near=len(text) // 2)
+        pieces.append(text[:cut])
+        text = text[cut:]
+
+    pieces.append(text)
+    return [piece.strip() for piece in pieces if piece.strip()]
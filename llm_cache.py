@@ -0,0 +1,33 @@
+from cachetools import TTLCache
+import hashlib
+import json
+
+
+class LLMCache:
+    """
+    Small in-process cache for Gemini responses.
+
+    Entries are keyed on a SHA-256 of everything that shapes the answer
+    (model, prompt messages, temperature). Old entries expire after `ttl`
+    seconds and the least recently used ones are dropped once `maxsize`
+    is reached.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: int = 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def cache_key(model: str, messages: list, temperature: float | None) -> str:
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        return self._cache.get(key)
+
+    def set(self, key: str, value) -> None:
+        self._cache[key] = value
@@ -1,39 +1,681 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from crewai import Agent, Task, Crew, LLM
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
+from google import genai
+from google.genai import types as genai_types
+from chunking import split_into_chunks
+from llm_cache import LLMCache
+from resilience import CircuitBreaker, CircuitOpenError, is_rate_limit_error, is_transient_error
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+import asyncio
+import httpx
+import json
+import logging
 import os
+import string
+
+# CrewAI takes seconds to import, so it is only imported when the crews
+# are first built (see _crews() below); these imports are for type hints only
+if TYPE_CHECKING:
+    from crewai import Crew
 
 # Load environment variables from .env file
 load_dotenv()
 
+# CrewAI logs full prompts/answers when verbose - keep it off unless asked
+# (set CREW_VERBOSE=true in .env while developing)
+VERBOSE = os.getenv("CREW_VERBOSE", "false").lower() == "true"
+
+if not VERBOSE:
+    for noisy_logger in ("crewai", "litellm"):
+        logging.getLogger(noisy_logger).setLevel(logging.WARNING)
+
 # Read Gemini API key from environment
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 if GEMINI_API_KEY is None:
     raise ValueError("GEMINI_API_KEY is not set. Please add it to your .env file.")
 
-# Configure Gemini LLM for CrewAI
-gemini_llm = LLM(
-    model="gemini/gemini-2.5-pro",  # You can change to another Gemini model if needed
-    api_key=GEMINI_API_KEY,
-    temperature=0.3,  # Slight creativity, but still stable
+# One pooled HTTP client for every Gemini call: connections stay open
+# (keep-alive, HTTP/2), so requests skip the TCP + TLS handshake.
+# Closed when the app shuts down.
+SHARED_HTTPX = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_keepalive_connections=64,
+        max_connections=128,
+        keepalive_expiry=60,
+    ),
+)
+
+# Passed to the google-genai client that CrewAI builds for each LLM.
+# google-genai sends its own timeout with every request (overriding the
+# httpx client's), so the limit has to be set here. It caps the WHOLE
+# call, and long answers (notes for a big chunk, 50 MCQs) can take
+# minutes, so it is generous; it is there so a stuck call cannot hang
+# forever. Calls that time out are not retried (see is_transient_error).
+GEMINI_TIMEOUT_SECONDS = int(os.getenv("GEMINI_TIMEOUT_SECONDS", "600"))
+
+GEMINI_CLIENT_PARAMS = {
+    "http_options": genai_types.HttpOptions(
+        httpx_async_client=SHARED_HTTPX,
+        timeout=GEMINI_TIMEOUT_SECONDS * 1000,  # in ms
+    ),
+}
+
+GEMINI_MODEL = "gemini-2.5-pro"  # You can change to another Gemini model if needed
+
+GEMINI_TEMPERATURE = 0.3  # Slight creativity, but still stable
+
+# Temperature 0 for tasks that should give the same answer every time
+# (topics, MCQs) - this also makes their cached answers reusable
+GEMINI_STRICT_TEMPERATURE = 0.0
+
+# Plain google-genai client for the streaming endpoints, which talk to
+# Gemini directly instead of going through a Crew
+genai_client = genai.Client(api_key=GEMINI_API_KEY, **GEMINI_CLIENT_PARAMS)
+
+# Cache of Gemini answers, so posting the same text again is instant.
+# Kept in memory, so every worker process has its own cache.
+llm_cache = LLMCache(maxsize=1024, ttl=3600)
+
+# After 10 failed Gemini calls in a row, refuse new calls for 30 seconds
+# instead of piling more requests onto a struggling API (counted per worker)
+gemini_breaker = CircuitBreaker(fail_max=10, reset_timeout=30)
+
+# Admission control: at most this many Gemini calls run at once in each
+# worker; the rest wait their turn (see /metrics to tune it)
+MAX_GEMINI_CONCURRENCY = int(os.getenv("MAX_GEMINI_CONCURRENCY", "32"))
+gemini_admission = asyncio.Semaphore(MAX_GEMINI_CONCURRENCY)
+admission_stats = {"in_flight": 0, "waiting": 0}
+
+# ---------- Output rules for the topics and notes stages ----------
+# Sent once as part of the agent persona (the system instruction)
+# instead of being repeated inside every task prompt. A stable system
+# prefix also lets Gemini reuse its implicit prompt cache across
+# requests. The MCQ and summary prompts have their own format and never
+# had these rules, so they do not get them.
+
+FORMAT_RULES = (
+    "OUTPUT RULES:\n"
+    "- Do NOT use any Markdown formatting (no *, no #, no **, no ```).\n"
+    "- Use only plain text.\n"
+)
+
+# ---------- Prompt pieces shared by the tasks below ----------
+
+# Parsed once at import; requests only substitute $text
+SUMMARY_PROMPT_TMPL = string.Template(
+    "Read the following study material and create a short, clear, "
+    "exam-focused summary in simple language. Use bullet points where possible.\n\n"
+    "CONTENT:\n$text"
+)
+
+
+def _system_instruction(persona: dict) -> str:
+    """The role/goal/backstory part of the prompt CrewAI builds for an agent."""
+    return f"You are {persona['role']}. {persona['backstory']}\nYour personal goal is: {persona['goal']}"
+
+
+# /summarize calls Gemini directly (no Crew), so the teacher persona that
+# used to be the summarizer agent is sent as the system instruction
+SUMMARIZER = {
+    "role": "Subject Teacher",
+    "goal": "Create short, exam-focused summaries of study material.",
+    "backstory": (
+        "You are a very good college teacher. "
+        "You read the given content and write clear, simple, point-wise notes "
+        "that help students revise before exams."
+    ),
+}
+
+SUMMARIZER_SYSTEM_PROMPT = _system_instruction(SUMMARIZER)
+
+SUMMARY_TEMPERATURE = GEMINI_TEMPERATURE
+
+TOPIC_FORMAT = (
+    "OUTPUT FORMAT (VERY IMPORTANT):\n"
+    "- Write in this style:\n"
+    "  Main Topic 1:\n"
+    "    - Subtopic 1\n"
+    "    - Subtopic 2\n"
+    "  Main Topic 2:\n"
+    "    - Subtopic 1\n"
+    "    - Subtopic 2\n"
+)
+
+TOPIC_EXPECTED_OUTPUT = (
+    "A bullet list of main topics and their subtopics, focused only on what is actually important for exams."
+)
+
+NOTES_RULES = (
+    "VERY IMPORTANT RULES:\n"
+    "- Write in clean headings and bullet points.\n"
+    "- Target answers that can directly be written in 6–8 mark questions.\n"
+    "- For each main topic, include:\n"
+    "  1) Definition (1–2 lines)\n"
+    "  2) Important points / properties (point-wise)\n"
+    "  3) Important operations / algorithms (in short)\n"
+    "  4) Advantages / disadvantages (if applicable)\n"
+    "  5) Applications / examples (if useful)\n"
+    "- Avoid long stories or over-explanation.\n"
+    "- Keep language simple, as if explaining to an average student before exam.\n\n"
+    "OUTPUT FORMAT (example style, but adapt to content):\n"
+    "Array:\n"
+    "  - Definition: ...\n"
+    "  - Important points:\n"
+    "    - ...\n"
+    "    - ...\n"
+    "  - Operations and time complexity:\n"
+    "    - Traversal: ...\n"
+    "    - Insertion: ...\n"
+    "  - Advantages:\n"
+    "    - ...\n"
+    "  - Disadvantages:\n"
+    "    - ...\n"
+    "  - Applications:\n"
+    "    - ...\n"
+)
+
+NOTES_EXPECTED_OUTPUT = (
+    "Plain text, point-wise exam notes for each main topic, "
+    "good enough to write 6–8 mark answers directly."
+)
+
+MCQ_RULES = (
+    "Create around {num_mcqs} MCQs.\n\n"
+    "RULES:\n"
+    "- Each question must have 4 options: (a), (b), (c), (d).\n"
+    "- Clearly mention the correct answer after each question.\n"
+    "- Questions should directly test understanding of the notes.\n"
+    "- Avoid too tricky or confusing questions.\n\n"
+    "OUTPUT FORMAT (very important):\n"
+    "Q1. <question text>\n"
+    "(a) option 1\n"
+    "(b) option 2\n"
+    "(c) option 3\n"
+    "(d) option 4\n"
+    "Answer: <option letter>\n\n"
+    "Q2. ... and so on."
+)
+
+MCQ_EXPECTED_OUTPUT = (
+    "A list of about {num_mcqs} MCQs in the specified format, each with options and correct answer."
 )
 
-app = FastAPI()
+# ---------- Agents and tasks (plain settings, built once at import) ----------
+# These are only the texts; every request builds its own Agent/Task/Crew
+# objects from them (see _crews() below), which is cheaper than copying
+# shared ones. The {content}, {num_mcqs}, ... placeholders are filled in
+# by crew.kickoff(inputs=...), so requests never rebuild prompt strings
+# and cache keys hash the same template every time.
+
+TOPIC_ANALYZER = {
+    "role": "Topic Analyzer",
+    "goal": "Identify the most important topics and subtopics from the given study material.",
+    "backstory": (
+        "You are an expert at reading long chapters and extracting only the most "
+        "important headings and subheadings that students should study for exams.\n\n"
+        + FORMAT_RULES
+    ),
+}
+
+NOTES_MAKER = {
+    "role": "Notes Maker",
+    "goal": "Write short, exam-focused notes in simple language.",
+    "backstory": (
+        "You are a friendly college teacher. You explain concepts in very simple terms "
+        "and create bullet-point notes that students can revise quickly before exams.\n\n"
+        + FORMAT_RULES
+    ),
+}
+
+MCQ_MAKER = {
+    "role": "MCQ Creator",
+    "goal": "Create clear MCQs based on the notes and topics, with 4 options and correct answer.",
+    "backstory": (
+        "You are an experienced question paper setter. You create fair and clear MCQs "
+        "that directly test understanding of the notes and topics."
+    ),
+}
+
+# The MCQ Creator runs on the strict LLM in _crews(); the streaming
+# endpoint calls Gemini itself with the same temperature
+MCQ_TEMPERATURE = GEMINI_STRICT_TEMPERATURE
+
+TOPIC_TASK = {
+    "description": (
+        "Read the following study material and extract the MOST IMPORTANT topics and subtopics "
+        "for exam preparation and give full length description or points.\n\n"
+        "CONTENT:\n{content}\n\n"
+        + TOPIC_FORMAT
+    ),
+    "expected_output": TOPIC_EXPECTED_OUTPUT,
+}
+
+NOTES_TASK = {
+    "description": (
+        "You are creating exam-focused notes for a B.Tech CSE student.\n"
+        "Use the topics and subtopics given in your context, plus the original content below, "
+        "to write SHORT, SCORING NOTES for university exams.\n\n"
+        "ORIGINAL CONTENT:\n"
+        "{content}\n\n"
+        + NOTES_RULES
+    ),
+    "expected_output": NOTES_EXPECTED_OUTPUT,
+}
+
+MCQ_TASK = {
+    "description": (
+        "Based on the notes given in your context, generate MCQs for exam preparation.\n\n"
+        + MCQ_RULES
+    ),
+    "expected_output": MCQ_EXPECTED_OUTPUT,
+}
+
+# ---------- Long documents: map-reduce over chunks ----------
+# Text longer than MAX_CHARS is split into chunks. Topics are extracted
+# from every chunk at the same time and merged, then notes are written
+# per chunk (merged topics + that chunk only) and joined, and the MCQs
+# are made from the joined notes.
+
+MAX_CHARS = 12_000  # tune to the model; above this a document is sharded
+
+TOPIC_MERGER = {
+    "role": "Topic Merger",
+    "goal": "Combine topic lists from different parts of one chapter into a single clean list.",
+    "backstory": (
+        "You are an experienced teacher who prepares the final syllabus outline. "
+        "You remove duplicates and keep the order in which topics appear in the chapter.\n\n"
+        + FORMAT_RULES
+    ),
+}
+
+CHUNK_TOPICS_TASK = {
+    "description": (
+        "Read the following PART of a longer study material and extract the MOST IMPORTANT "
+        "topics and subtopics for exam preparation.\n\n"
+        "CONTENT:\n{content}\n\n"
+        + TOPIC_FORMAT
+    ),
+    "expected_output": TOPIC_EXPECTED_OUTPUT,
+}
+
+TOPIC_MERGE_TASK = {
+    "description": (
+        "The topic lists below were extracted from consecutive parts of ONE chapter. "
+        "Merge them into a single list: combine duplicates, keep the chapter order, "
+        "and keep only what is important for exams.\n\n"
+        "TOPIC LISTS:\n{partial_topics}\n\n"
+        + TOPIC_FORMAT
+    ),
+    "expected_output": TOPIC_EXPECTED_OUTPUT,
+}
+
+CHUNK_NOTES_TASK = {
+    "description": (
+        "You are creating exam-focused notes for a B.Tech CSE student.\n"
+        "Below are the topics of the whole chapter and ONE PART of the chapter. "
+        "Write SHORT, SCORING NOTES for university exams, covering only the topics "
+        "that appear in this part.\n\n"
+        "TOPICS AND SUBTOPICS:\n{topics}\n\n"
+        "PART OF THE ORIGINAL CONTENT:\n{content}\n\n"
+        + NOTES_RULES
+    ),
+    "expected_output": NOTES_EXPECTED_OUTPUT,
+}
+
+# MCQs from notes passed in as {notes} (used by the long path and streaming)
+NOTES_MCQ_TASK = {
+    "description": (
+        "Based on the notes below, generate MCQs for exam preparation.\n\n"
+        "NOTES:\n{notes}\n\n"
+        + MCQ_RULES
+    ),
+    "expected_output": MCQ_EXPECTED_OUTPUT,
+}
+
+# ---------- Crews (CrewAI is loaded on first use) ----------
+
+@lru_cache(maxsize=None)
+def _crews() -> SimpleNamespace:
+    """
+    Import CrewAI and create the two Gemini LLMs the first time a crew is
+    needed. Returns functions that build a fresh crew for one request;
+    every crew they build shares the same two LLMs (and HTTP client).
+
+    Importing crewai is the slowest part of starting this app, so it
+    happens here instead of at import time. The lifespan below calls this
+    at startup unless PRELOAD_CREWS=false (e.g. on serverless, where the
+    /summarize endpoints never need a crew). Request handlers use
+    _load_crews().
+    """
+    from crewai import Agent, Task, Crew, LLM, Process
+    from crewai.agents.crew_agent_executor import CrewAgentExecutor
+
+    # Configure Gemini LLM for CrewAI
+    gemini_llm = LLM(
+        model=f"gemini/{GEMINI_MODEL}",
+        api_key=GEMINI_API_KEY,
+        temperature=GEMINI_TEMPERATURE,
+        client_params=GEMINI_CLIENT_PARAMS,
+    )
+
+    # Same model for tasks that should give the same answer every time
+    gemini_llm_strict = LLM(
+        model=f"gemini/{GEMINI_MODEL}",
+        api_key=GEMINI_API_KEY,
+        temperature=GEMINI_STRICT_TEMPERATURE,
+        client_params=GEMINI_CLIENT_PARAMS,
+    )
+
+    def agent(persona: dict, llm) -> Agent:
+        # CrewAgentExecutor awaits llm.acall() under akickoff(); CrewAI's
+        # default executor would run the blocking llm.call() in a thread.
+        # max_retry_limit=0 turns off CrewAI's own instant retries, so
+        # every retry goes through _call_gemini (with backoff).
+        return Agent(
+            **persona,
+            llm=llm,
+            verbose=VERBOSE,  # CREW_VERBOSE=true prints logs in terminal - helpful for debugging
+            executor_class=CrewAgentExecutor,
+            max_retry_limit=0,
+        )
+
+    def single_task_crew(persona: dict, llm, task: dict) -> Crew:
+        worker = agent(persona, llm)
+        return Crew(agents=[worker], tasks=[Task(**task, agent=worker)], verbose=VERBOSE)
+
+    # ---------- Study Material Crew (topics -> notes -> MCQs) ----------
+
+    def study(with_mcqs: bool = True) -> Crew:
+        topic_analyzer = agent(TOPIC_ANALYZER, gemini_llm_strict)
+        notes_maker = agent(NOTES_MAKER, gemini_llm)
+        topic_task = Task(**TOPIC_TASK, agent=topic_analyzer)
+        notes_task = Task(**NOTES_TASK, agent=notes_maker, context=[topic_task])
+        agents = [topic_analyzer, notes_maker]
+        tasks = [topic_task, notes_task]
+
+        # Without MCQs for the streaming endpoint, which streams them itself
+        if with_mcqs:
+            mcq_maker = agent(MCQ_MAKER, gemini_llm_strict)
+            agents.append(mcq_maker)
+            tasks.append(Task(**MCQ_TASK, agent=mcq_maker, context=[notes_task]))
+
+        return Crew(agents=agents, tasks=tasks, process=Process.sequential, verbose=VERBOSE)
+
+    return SimpleNamespace(
+        study=study,
+        chunk_topics=lambda: single_task_crew(TOPIC_ANALYZER, gemini_llm_strict, CHUNK_TOPICS_TASK),
+        topic_merge=lambda: single_task_crew(TOPIC_MERGER, gemini_llm_strict, TOPIC_MERGE_TASK),
+        chunk_notes=lambda: single_task_crew(NOTES_MAKER, gemini_llm, CHUNK_NOTES_TASK),
+        notes_mcq=lambda: single_task_crew(MCQ_MAKER, gemini_llm_strict, NOTES_MCQ_TASK),
+    )
+
+
+_crews_lock = asyncio.Lock()
+
+
+async def _load_crews() -> SimpleNamespace:
+    """
+    _crews() for request handlers. With PRELOAD_CREWS=false the first
+    call imports CrewAI (a few seconds), so it runs in a thread instead of
+    blocking every other request and stream on the event loop.
+    """
+    if _crews.cache_info().currsize:
+        return _crews()
+    async with _crews_lock:  # only one thread builds them
+        return await asyncio.to_thread(_crews)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Every uvicorn worker is a fresh process that imports this module, so
+    # SHARED_HTTPX, genai_client and the LLMs built by _crews() are
+    # per-worker and no connection is opened before the worker starts
+    # serving.
+    # Build the crews now so the first request does not pay for importing
+    # CrewAI. Set PRELOAD_CREWS=false to skip this (e.g. on serverless);
+    # the first crew request then imports it, in a thread (_load_crews).
+    if os.getenv("PRELOAD_CREWS", "true").lower() == "true":
+        _crews()
+    yield
+    await SHARED_HTTPX.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS configuration
-# Allow all origins for now (for local development)
+# Only the listed frontends may call the API. Set ALLOWED_ORIGINS in .env
+# as a comma-separated list, e.g. "https://my-site.com,http://localhost:3000"
+ALLOWED_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
+    if origin.strip()
+]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # in production you can restrict this
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type"],
+    max_age=86400,  # browsers may cache the preflight answer for a day
 )
 
 
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request, exc: CircuitOpenError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+# ---------- Helpers ----------
+
+def _crew_cache_key(crew: "Crew", inputs: dict) -> str:
+    """Build the cache key for a crew from its agents, tasks, inputs and LLM settings."""
+    messages = [{"inputs": inputs}]
+    for task in crew.tasks:
+        agent = task.agent
+        messages.append({
+            "role": agent.role,
+            "goal": agent.goal,
+            "backstory": agent.backstory,
+            "description": task.description,
+            "expected_output": task.expected_output,
+            "model": agent.llm.model,
+            "temperature": agent.llm.temperature,
+        })
+
+    # Each stage can use different LLM settings, so model + temperature
+    # are part of every task's entry above
+    return LLMCache.cache_key("crew", messages, temperature=None)
+
+
+def _sse(payload: dict) -> str:
+    """Format one Server-Sent Event carrying a JSON payload."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def _sse_keepalive(task: asyncio.Task):
+    """
+    Yield an SSE comment every SSE_KEEPALIVE_SECONDS until `task` is done.
+
+    Proxies and load balancers close connections that stay silent for too
+    long; clients ignore comment lines.
+    """
+    while not task.done():
+        done, _ = await asyncio.wait({task}, timeout=SSE_KEEPALIVE_SECONDS)
+        if not done:
+            yield ": keepalive\n\n"
+
+
+@asynccontextmanager
+async def _admitted():
+    """Wait for a free gemini_admission slot, keeping admission_stats up to date."""
+    admission_stats["waiting"] += 1
+    try:
+        await gemini_admission.acquire()
+    finally:
+        admission_stats["waiting"] -= 1
+
+    admission_stats["in_flight"] += 1
+    try:
+        yield
+    finally:
+        admission_stats["in_flight"] -= 1
+        gemini_admission.release()
+
+
+async def _call_gemini(call, retry_if=is_transient_error):
+    """
+    Await `call()` (anything that talks to Gemini) with retries.
+
+    Each attempt waits for an admission slot first. Errors for which
+    `retry_if` is true (by default rate limits, 5xx errors and network
+    errors) are retried up to 5 times with exponential backoff + jitter.
+    Failures also feed gemini_breaker, which raises CircuitOpenError
+    right away while Gemini is down.
+    """
+    gemini_breaker.before_call()
+    try:
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(5),
+            wait=wait_exponential_jitter(initial=1, max=30),
+            retry=retry_if_exception(retry_if),
+            reraise=True,
+        ):
+            with attempt:
+                # the slot is released while waiting to retry
+                async with _admitted():
+                    result = await call()
+    except Exception as e:
+        if is_transient_error(e):
+            gemini_breaker.record_failure()
+        raise
+
+    gemini_breaker.record_success()
+    return result
+
+
+def _gemini_config(system_instruction: str, temperature: float) -> genai_types.GenerateContentConfig:
+    return genai_types.GenerateContentConfig(
+        temperature=temperature,
+        system_instruction=system_instruction,
+    )
+
+
+async def _generate_gemini(prompt: str, system_instruction: str, temperature: float) -> str:
+    """Ask Gemini directly (no Crew) and return the answer text. Cached and retried."""
+    key = LLMCache.cache_key(
+        GEMINI_MODEL,
+        [{"system": system_instruction, "prompt": prompt}],
+        temperature,
+    )
+    if (cached := llm_cache.get(key)) is not None:
+        return cached
+
+    response = await _call_gemini(
+        lambda: genai_client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=_gemini_config(system_instruction, temperature),
+        )
+    )
+    text = response.text or ""
+    # An empty answer (e.g. blocked by safety filters) is not cached, so
+    # asking again gets a fresh try
+    if text:
+        llm_cache.set(key, text)
+    return text
+
+
+async def _stream_gemini(prompt: str, system_instruction: str, temperature: float):
+    """Stream Gemini's answer to `prompt` as text pieces."""
+    # Only opening the stream is retried - a retry halfway through would
+    # send the client the same text twice
+    stream = await _call_gemini(
+        lambda: genai_client.aio.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=_gemini_config(system_instruction, temperature),
+        )
+    )
+    # Gemini writes the answer while we read it, so reading the stream
+    # takes an admission slot too, like a normal call
+    async with _admitted():
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
+
+async def _gather_or_cancel(*aws):
+    """
+    Like asyncio.gather, but when one of them fails the others are
+    cancelled (and waited for) before the error is raised, so they do not
+    keep holding admission slots and spending Gemini quota for a response
+    nobody will get.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _run_crew(crew: "Crew", inputs: dict | None = None) -> list[str]:
+    """
+    Run a crew with CrewAI's native async kickoff.
+
+    Returns the text output of every task, in task order. The Gemini
+    provider behind the crew's LLMs uses the async google-genai client, so
+    waiting for Gemini does not block the event loop or a thread.
+    Answers are cached, so the same crew + inputs skips Gemini entirely,
+    and transient Gemini errors are retried (see _call_gemini).
+    """
+    inputs = inputs or {}
+    key = _crew_cache_key(crew, inputs)
+    if (cached := llm_cache.get(key)) is not None:
+        return cached
+
+    async def _kickoff():
+        # Finished tasks keep their output on this crew's tasks, so a retry
+        # only re-runs the tasks that did not finish. The remaining tasks
+        # still read the finished ones through their `context`.
+        pending = [task for task in crew.tasks if task.output is None]
+        if len(pending) == len(crew.tasks):
+            await crew.akickoff(inputs=inputs)
+        else:
+            from crewai import Crew  # already imported by _crews()
+
+            await Crew(
+                agents=crew.agents,
+                tasks=pending,
+                process=crew.process,
+                verbose=VERBOSE,
+            ).akickoff(inputs=inputs)
+
+    # CrewAI's LLM already retries rate limits itself (3 tries with
+    # backoff) inside every call, so here only 5xx and network errors are
+    # retried - otherwise one 429 would turn into 15 calls
+    await _call_gemini(
+        _kickoff,
+        retry_if=lambda e: is_transient_error(e) and not is_rate_limit_error(e),
+    )
+    texts = [task.output.raw for task in crew.tasks]
+    if all(texts):  # same as _generate_gemini: empty answers are not cached
+        llm_cache.set(key, texts)
+    return texts
+
+
 # ---------- Basic Routes ----------
 
 @app.get("/")
@@ -44,243 +686,280 @@ def read_root():
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    """Gemini admission counters for this worker (used to tune MAX_GEMINI_CONCURRENCY)."""
+    return {
+        "gemini_in_flight": admission_stats["in_flight"],
+        "gemini_waiting": admission_stats["waiting"],
+        "gemini_max_concurrency": MAX_GEMINI_CONCURRENCY,
+    }
+
 # ---------- Request Model for Summarization ----------
 
+# Invalid requests are rejected here with a 422, before any Gemini call
+
 class SummarizeRequest(BaseModel):
-    text: str
+    text: str = Field(min_length=20, max_length=200_000)
+
+# Declaring response models lets FastAPI serialize straight to JSON bytes
+# with Pydantic's Rust core instead of going through the stdlib json module
+class SummaryResponse(BaseModel):
+    summary: str
 
 # ---------- Agentic AI: Simple Summarizer Agent ----------
 
 @app.post("/summarize")
-def summarize_text(request: SummarizeRequest):
-    """Use a CrewAI Agent + Gemini to summarize study material."""
-    user_text = request.text
-
-    # 1. Define the agent (like a role in a team)
-    summarizer_agent = Agent(
-        role="Subject Teacher",
-        goal="Create short, exam-focused summaries of study material.",
-        backstory=(
-            "You are a very good college teacher. "
-            "You read the given content and write clear, simple, point-wise notes "
-            "that help students revise before exams."
-        ),
-        llm=gemini_llm,
-        verbose=True,  # prints logs in terminal - helpful for debugging
+async def summarize_text(request: SummarizeRequest) -> SummaryResponse:
+    """
+    Use Gemini to summarize study material.
+
+    A single prompt needs no Crew, so this calls Gemini directly with the
+    teacher persona as the system instruction.
+    """
+    # 1. Fill the prompt template with the user's text
+    prompt = SUMMARY_PROMPT_TMPL.substitute(text=request.text)
+
+    # 2. Ask Gemini
+    summary_text = await _generate_gemini(prompt, SUMMARIZER_SYSTEM_PROMPT, SUMMARY_TEMPERATURE)
+
+    # 3. Return result back to frontend / client
+    return SummaryResponse(summary=summary_text)
+
+class StudyMaterialRequest(BaseModel):
+    text: str = Field(min_length=20, max_length=200_000)  # longer than MAX_CHARS is sharded
+    num_mcqs: int = Field(default=5, ge=1, le=50)  # default 5 MCQs, can change from frontend or docs
+
+class StudyMaterialResponse(BaseModel):
+    topics: str
+    notes: str
+    mcqs: str
+
+async def _generate_study_material(content: str, num_mcqs: int) -> StudyMaterialResponse:
+    """Run the topics -> notes -> MCQs crew for one piece of study material."""
+    if len(content) > MAX_CHARS:
+        return await _generate_long_study_material(content, num_mcqs)
+
+    # ---- 1. A fresh crew for this request (tasks + agents keep per-run state) ----
+
+    crew = (await _load_crews()).study()
+
+    # ---- 2. Run topics -> notes -> MCQs in one kickoff ----
+    # Each task gets the previous task's output through its `context`.
+
+    topics_text, notes_text, mcq_text = await _run_crew(
+        crew,
+        inputs={"content": content, "num_mcqs": num_mcqs},
+    )
+
+    # ---- 3. Return all parts separately ----
+
+    return StudyMaterialResponse(
+        topics=topics_text,
+        notes=notes_text,
+        mcqs=mcq_text,
     )
 
-    # 2. Define the task assigned to this agent
-    summarize_task = Task(
-        description=(
-            "Read the following study material and create a short, clear, "
-            "exam-focused summary in simple language. Use bullet points where possible.\n\n"
-            f"CONTENT:\n{user_text}"
-        ),
-        expected_output=(
-            "A concise summary of the content, with bullet points, "
-            "covering all important concepts for exam preparation."
-        ),
-        agent=summarizer_agent,
+async def _generate_long_study_material(content: str, num_mcqs: int) -> StudyMaterialResponse:
+    """Same output as _generate_study_material, map-reduced over chunks of `content`."""
+    topics_text, notes_text = await _long_topics_and_notes(content)
+
+    [mcq_text] = await _run_crew(
+        (await _load_crews()).notes_mcq(),
+        inputs={"notes": notes_text, "num_mcqs": num_mcqs},
     )
 
-    # 3. Create a crew with this single agent (later we'll add more agents)
-    crew = Crew(
-        agents=[summarizer_agent],
-        tasks=[summarize_task],
-        verbose=True,
+    return StudyMaterialResponse(
+        topics=topics_text,
+        notes=notes_text,
+        mcqs=mcq_text,
     )
 
-    # 4. Run the crew (kickoff = start the work)
-    result = crew.kickoff()
+async def _long_topics_and_notes(content: str) -> tuple[str, str]:
+    """Topics and notes for a long document, map-reduced over chunks of `content`."""
+    chunks = split_into_chunks(content, MAX_CHARS)
+    crews = await _load_crews()
 
-    # 5. Return result back to frontend / client
-    return {
-        "summary": str(result)
-    }
+    # ---- 1. Topics of every chunk, all at the same time ----
 
-class StudyMaterialRequest(BaseModel):
-    text: str
-    num_mcqs: int = 5  # default 5 MCQs, can change from frontend or docs
+    chunk_topics = await _gather_or_cancel(*[
+        _run_crew(crews.chunk_topics(), inputs={"content": chunk})
+        for chunk in chunks
+    ])
+
+    # ---- 2. Merge them into one topic list ----
+
+    [topics_text] = await _run_crew(
+        crews.topic_merge(),
+        inputs={"partial_topics": "\n\n".join(topics for [topics] in chunk_topics)},
+    )
+
+    # ---- 3. Notes per chunk (merged topics + that chunk only), joined in order ----
+
+    chunk_notes = await _gather_or_cancel(*[
+        _run_crew(crews.chunk_notes(), inputs={"topics": topics_text, "content": chunk})
+        for chunk in chunks
+    ])
+    notes_text = "\n\n".join(notes for [notes] in chunk_notes)
+
+    return topics_text, notes_text
+
+async def _topics_and_notes(content: str) -> tuple[str, str]:
+    """Run only the topics and notes stages (short or long path)."""
+    if len(content) > MAX_CHARS:
+        return await _long_topics_and_notes(content)
+
+    topics_text, notes_text = await _run_crew(
+        (await _load_crews()).study(with_mcqs=False),
+        inputs={"content": content},
+    )
+    return topics_text, notes_text
 
 @app.post("/generate_study_material")
-def generate_study_material(request: StudyMaterialRequest):
+async def generate_study_material(request: StudyMaterialRequest) -> StudyMaterialResponse:
     """
     Use multiple CrewAI agents + Gemini to:
     1) Analyze topics
     2) Generate notes
     3) Generate MCQs
 
-    We run them step-by-step and return all three parts separately.
+    All three steps are tasks of one crew (_crews().study), run in order, and
+    we return all three parts separately.
     """
-    content = request.text
-    num_mcqs = request.num_mcqs
+    return await _generate_study_material(request.text, request.num_mcqs)
 
-    # ---- 1. Define Agents ----
-
-    topic_analyzer = Agent(
-        role="Topic Analyzer",
-        goal="Identify the most important topics and subtopics from the given study material.",
-        backstory=(
-            "You are an expert at reading long chapters and extracting only the most "
-            "important headings and subheadings that students should study for exams."
-        ),
-        llm=gemini_llm,
-        verbose=True,
-    )
+# ---------- Streaming (Server-Sent Events) ----------
+# These endpoints send text to the client as Gemini writes it. Each event
+# is `data: {...}` with a JSON object; the last one is {"stage": "done"}.
+# Lines starting with ":" are keepalive comments that clients ignore.
 
-    notes_maker = Agent(
-        role="Notes Maker",
-        goal="Write short, exam-focused notes in simple language.",
-        backstory=(
-            "You are a friendly college teacher. You explain concepts in very simple terms "
-            "and create bullet-point notes that students can revise quickly before exams."
-        ),
-        llm=gemini_llm,
-        verbose=True,
-    )
+SSE_KEEPALIVE_SECONDS = 15
 
-    mcq_maker = Agent(
-        role="MCQ Creator",
-        goal="Create clear MCQs based on the notes and topics, with 4 options and correct answer.",
-        backstory=(
-            "You are an experienced question paper setter. You create fair and clear MCQs "
-            "that directly test understanding of the notes and topics."
-        ),
-        llm=gemini_llm,
-        verbose=True,
-    )
+# Tell browsers and proxies (e.g. nginx) not to cache or buffer the
+# stream, so every event reaches the client straight away
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
-    # ---- 2. TOPIC TASK: First crew -> only topics ----
-
-    topic_task = Task(
-        description=(
-            "Read the following study material and extract the MOST IMPORTANT topics and subtopics "
-            "for exam preparation and give full length description or points.\n\n"
-            f"CONTENT:\n{content}\n\n"
-            "OUTPUT FORMAT (VERY IMPORTANT):\n"
-            "- Do NOT use any Markdown formatting (no *, no #, no **, no ```).\n"
-            "- Use only plain text.\n"
-            "- Write in this style:\n"
-            "  Main Topic 1:\n"
-            "    - Subtopic 1\n"
-            "    - Subtopic 2\n"
-            "  Main Topic 2:\n"
-            "    - Subtopic 1\n"
-            "    - Subtopic 2\n"
-        ),
-        expected_output=(
-            "A bullet list of main topics and their subtopics, focused only on what is actually important for exams."
-        ),
-        agent=topic_analyzer,
-    )
+@app.post("/summarize/stream")
+async def summarize_text_stream(request: SummarizeRequest):
+    """Like /summarize, but streams the summary as it is generated."""
+    prompt = SUMMARY_PROMPT_TMPL.substitute(text=request.text)
 
-    topics_crew = Crew(
-        agents=[topic_analyzer],
-        tasks=[topic_task],
-        verbose=True,
-    )
-
-    topics_result = topics_crew.kickoff()
-    topics_text = str(topics_result)
-
-    # ---- 3. NOTES TASK: second crew -> use topics + original content ----
-
-    notes_task = Task(
-        description=(
-            "You are creating exam-focused notes for a B.Tech CSE student.\n"
-            "Use the topics and subtopics listed below, plus the original content, "
-            "to write SHORT, SCORING NOTES for university exams.\n\n"
-            "TOPICS AND SUBTOPICS:\n"
-            f"{topics_text}\n\n"
-            "ORIGINAL CONTENT:\n"
-            f"{content}\n\n"
-            "VERY IMPORTANT RULES:\n"
-            "- DO NOT use Markdown (no *, no #, no **, no ```).\n"
-            "- Use ONLY plain text.\n"
-            "- Write in clean headings and bullet points.\n"
-            "- Target answers that can directly be written in 6–8 mark questions.\n"
-            "- For each main topic, include:\n"
-            "  1) Definition (1–2 lines)\n"
-            "  2) Important points / properties (point-wise)\n"
-            "  3) Important operations / algorithms (in short)\n"
-            "  4) Advantages / disadvantages (if applicable)\n"
-            "  5) Applications / examples (if useful)\n"
-            "- Avoid long stories or over-explanation.\n"
-            "- Keep language simple, as if explaining to an average student before exam.\n\n"
-            "OUTPUT FORMAT (example style, but adapt to content):\n"
-            "Array:\n"
-            "  - Definition: ...\n"
-            "  - Important points:\n"
-            "    - ...\n"
-            "    - ...\n"
-            "  - Operations and time complexity:\n"
-            "    - Traversal: ...\n"
-            "    - Insertion: ...\n"
-            "  - Advantages:\n"
-            "    - ...\n"
-            "  - Disadvantages:\n"
-            "    - ...\n"
-            "  - Applications:\n"
-            "    - ...\n"
-        ),
-        expected_output=(
-            "Plain text, point-wise exam notes (no markdown) for each main topic, "
-            "good enough to write 6–8 mark answers directly."
-        ),
-        agent=notes_maker,
-    )
+    async def events():
+        try:
+            async for delta in _stream_gemini(prompt, SUMMARIZER_SYSTEM_PROMPT, SUMMARY_TEMPERATURE):
+                yield _sse({"stage": "summary", "delta": delta})
+        except Exception as e:
+            yield _sse({"stage": "error", "error": str(e)})
+            return
+        yield _sse({"stage": "done"})
 
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
-    notes_crew = Crew(
-        agents=[notes_maker],
-        tasks=[notes_task],
-        verbose=True,
-    )
+@app.post("/generate_study_material/stream")
+async def generate_study_material_stream(request: StudyMaterialRequest):
+    """
+    Like /generate_study_material, but as a stream.
 
-    notes_result = notes_crew.kickoff()
-    notes_text = str(notes_result)
-
-    # ---- 4. MCQ TASK: third crew -> use notes as base ----
-
-    mcq_task = Task(
-        description=(
-            "Based on the notes below, generate MCQs for exam preparation.\n\n"
-            f"NOTES:\n{notes_text}\n\n"
-            f"Create around {num_mcqs} MCQs.\n\n"
-            "RULES:\n"
-            "- Each question must have 4 options: (a), (b), (c), (d).\n"
-            "- Clearly mention the correct answer after each question.\n"
-            "- Questions should directly test understanding of the notes.\n"
-            "- Avoid too tricky or confusing questions.\n\n"
-            "OUTPUT FORMAT (very important):\n"
-            "Q1. <question text>\n"
-            "(a) option 1\n"
-            "(b) option 2\n"
-            "(c) option 3\n"
-            "(d) option 4\n"
-            "Answer: <option letter>\n\n"
-            "Q2. ... and so on."
-        ),
-        expected_output=(
-            f"A list of about {num_mcqs} MCQs in the specified format, each with options and correct answer."
-        ),
-        agent=mcq_maker,
-    )
+    A {"stage": "started"} event is sent right away. Topics and notes are
+    generated next (keepalive comments are sent meanwhile) and sent as
+    one event each; the MCQs (the longest stage) are then streamed piece
+    by piece.
+    """
+    content = request.text
+    num_mcqs = request.num_mcqs
 
-    mcq_crew = Crew(
-        agents=[mcq_maker],
-        tasks=[mcq_task],
-        verbose=True,
-    )
+    async def events():
+        try:
+            yield _sse({"stage": "started"})
+
+            work = asyncio.create_task(_topics_and_notes(content))
+            try:
+                async for keepalive in _sse_keepalive(work):
+                    yield keepalive
+                topics_text, notes_text = work.result()
+            finally:
+                work.cancel()  # does nothing if finished; stops it if the client left
+
+            yield _sse({"stage": "topics", "text": topics_text})
+            yield _sse({"stage": "notes", "text": notes_text})
+
+            from crewai.utilities.string_utils import interpolate_only
+
+            # Same prompt, persona and temperature the MCQ crew would use
+            prompt = interpolate_only(
+                NOTES_MCQ_TASK["description"],
+                {"notes": notes_text, "num_mcqs": num_mcqs},
+            )
+            async for delta in _stream_gemini(
+                prompt,
+                _system_instruction(MCQ_MAKER),
+                MCQ_TEMPERATURE,
+            ):
+                yield _sse({"stage": "mcqs", "delta": delta})
+        except Exception as e:
+            yield _sse({"stage": "error", "error": str(e)})
+            return
+        yield _sse({"stage": "done"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# ---------- Batch: many documents in one request ----------
+
+class BatchRequest(BaseModel):
+    items: list[StudyMaterialRequest] = Field(min_length=1, max_length=50)
+    max_concurrency: int = Field(default=8, ge=1, le=32)  # how many items talk to Gemini at the same time
+
+class BatchItemError(BaseModel):
+    error: str
+
+@app.post("/generate_study_material_batch")
+async def generate_study_material_batch(
+    request: BatchRequest,
+) -> list[StudyMaterialResponse | BatchItemError]:
+    """
+    Generate study material for several documents at once.
 
-    mcq_result = mcq_crew.kickoff()
-    mcq_text = str(mcq_result)
+    Items run concurrently (at most `max_concurrency` at a time), so the
+    whole batch takes about as long as its slowest item. The result list
+    is in the same order as `items`; an item that failed is returned as
+    {"error": "..."} instead of failing the whole batch.
+    """
+    semaphore = asyncio.Semaphore(request.max_concurrency)
 
-    # ---- 5. Return all parts separately ----
+    async def _one(item: StudyMaterialRequest) -> StudyMaterialResponse:
+        async with semaphore:
+            return await _generate_study_material(item.text, item.num_mcqs)
 
-    return {
-        "topics": topics_text,
-        "notes": notes_text,
-        "mcqs": mcq_text,
-    }
+    results = await asyncio.gather(
+        *[_one(item) for item in request.items],
+        return_exceptions=True,
+    )
 
+    return [
+        BatchItemError(error=str(result)) if isinstance(result, Exception) else result
+        for result in results
+    ]
+
+
+# ---------- Run the server ----------
+# python main.py starts uvicorn with uvloop + httptools and
+# WEB_CONCURRENCY worker processes (default 1). Same as:
+#   uvicorn main:app --workers 1 --loop uvloop --http httptools --log-level warning
+# Each worker loads CrewAI (about 230 MB of memory) and has its own
+# llm_cache, gemini_breaker and admission limit, so more workers mean
+# more memory and fewer cache hits. One worker already handles many
+# requests at once, since Gemini calls are async; only raise it on a
+# machine with memory to spare.
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+    )
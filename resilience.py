@@ -0,0 +1,94 @@
+from google.genai import errors as genai_errors
+import httpx
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Gemini while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing service for a while.
+
+    After `fail_max` failures in a row the breaker opens: every call is
+    refused with CircuitOpenError for `reset_timeout` seconds. After that,
+    calls are let through again; one success closes the breaker, one more
+    failure opens it again.
+    """
+
+    def __init__(self, fail_max: int = 10, reset_timeout: float = 30):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+
+    def before_call(self) -> None:
+        if self._opened_at is None:
+            return
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            raise CircuitOpenError("Gemini is failing right now, please try again shortly.")
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._failures >= self.fail_max:
+            self._opened_at = time.monotonic()
+
+
+def _error_chain(error: BaseException):
+    """The error and everything it was raised from (CrewAI wraps provider errors)."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def _status_code(error: BaseException) -> int | None:
+    if isinstance(error, genai_errors.APIError):
+        return error.code
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return None
+
+
+def is_timeout_error(error: BaseException) -> bool:
+    """
+    True if the call ran out of time: the request timed out while waiting
+    for the answer, or Gemini gave up with 504 (deadline exceeded).
+    """
+    return any(
+        isinstance(cause, (httpx.ReadTimeout, httpx.WriteTimeout)) or _status_code(cause) == 504
+        for cause in _error_chain(error)
+    )
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    True for errors worth retrying: rate limits (429), Gemini server
+    errors (5xx) and network problems. The whole exception chain is
+    checked.
+
+    Timeouts are not retried: the same prompt would most likely take
+    too long again, and every attempt is paid for.
+    """
+    if is_timeout_error(error):
+        return False
+
+    for cause in _error_chain(error):
+        status = _status_code(cause)
+        if status is not None and (status == 429 or status >= 500):
+            return True
+        if isinstance(cause, httpx.TransportError):
+            return True
+
+    return False
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """True if Gemini refused the call with 429 (rate limit / quota)."""
+    return any(_status_code(cause) == 429 for cause in _error_chain(error))
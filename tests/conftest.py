@@ -0,0 +1,7 @@
+import os
+
+# main.py needs a key at import time; tests never reach the real API
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("PRELOAD_CREWS", "false")
+os.environ.setdefault("CREWAI_DISABLE_TELEMETRY", "true")
+os.environ.setdefault("OTEL_SDK_DISABLED", "true")
@@ -0,0 +1,72 @@
+from chunking import split_into_chunks
+
+
+def _words(text: str) -> list[str]:
+    return text.split()
+
+
+def test_short_text_is_one_chunk():
+    assert split_into_chunks("  Arrays are lists.  ", 100) == ["Arrays are lists."]
+
+
+def test_blank_text_gives_no_chunks():
+    assert split_into_chunks(" \n\n ", 100) == []
+
+
+def test_prefers_paragraph_breaks():
+    first = "a" * 60
+    second = "b " * 30
+    chunks = split_into_chunks(f"{first}\n\n{second}", 100)
+    assert chunks == [first, second.strip()]
+
+
+def test_single_newlines_are_used_when_there_are_no_paragraphs():
+    lines = [f"line {i} about arrays" for i in range(50)]
+    chunks = split_into_chunks("\n".join(lines), 200)
+
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    # every chunk is made of whole lines
+    for chunk in chunks:
+        assert all(line in lines for line in chunk.split("\n"))
+
+
+def test_crlf_line_endings():
+    text = "\r\n".join(f"line {i} about arrays" for i in range(50))
+    chunks = split_into_chunks(text, 200)
+
+    assert len(chunks) > 1
+    assert not any("\r" in chunk for chunk in chunks)
+
+
+def test_one_long_paragraph_is_cut_between_sentences():
+    text = "Windows lets users control apps and windows. " * 300
+    chunks = split_into_chunks(text, 12_000)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 12_000 for chunk in chunks)
+    assert all(chunk.endswith("windows.") for chunk in chunks)
+
+
+def test_words_are_never_cut_when_there_is_whitespace():
+    text = " ".join(f"word{i}" for i in range(3000))
+    chunks = split_into_chunks(text, 1000)
+
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    assert [w for chunk in chunks for w in _words(chunk)] == _words(text)
+
+
+def test_no_tiny_tail_chunk():
+    text = "x " * 6000 + "y"  # 12,001 characters
+    chunks = split_into_chunks(text, 12_000)
+
+    assert len(chunks) == 2
+    assert min(len(chunk) for chunk in chunks) >= 3000
+    assert [w for chunk in chunks for w in _words(chunk)] == _words(text)
+
+
+def test_text_without_whitespace_is_hard_cut_evenly():
+    chunks = split_into_chunks("a" * 12_001, 12_000)
+
+    assert "".join(chunks) == "a" * 12_001
+    assert all(len(chunk) <= 12_000 for chunk in chunks)
+    assert min(len(chunk) for chunk in chunks) >= 3000
@@ -0,0 +1,192 @@
+import asyncio
+import math
+
+import crewai.llms.retry
+import pytest
+from google.genai import errors as genai_errors
+from google.genai import models as genai_models
+from google.genai import types as genai_types
+from tenacity import wait_none
+
+import main
+from llm_cache import LLMCache
+from resilience import CircuitBreaker
+
+TEXT = "Arrays store elements of the same type in contiguous memory."
+
+STAGES = {"Topic Analyzer": "topics", "Notes Maker": "notes", "MCQ Creator": "mcqs"}
+
+
+class FakeGemini:
+    """Stands in for AsyncModels.generate_content and records every call by stage."""
+
+    def __init__(self):
+        self.calls = []
+        self.configs = []
+        self.failures = {}  # stage -> (status code, how many times to fail)
+
+    def fail(self, stage: str, code: int, times: float = math.inf) -> None:
+        self.failures[stage] = (code, times)
+
+    async def generate_content(self, _models, *, model, contents, config=None, **kwargs):
+        instruction = str(config.system_instruction) if config else ""
+        stage = next((name for role, name in STAGES.items() if role in instruction), "direct")
+        self.calls.append(stage)
+        self.configs.append(config)
+
+        code, times = self.failures.get(stage, (None, 0))
+        if times > 0:
+            self.failures[stage] = (code, times - 1)
+            error_class = genai_errors.ServerError if code >= 500 else genai_errors.ClientError
+            raise error_class(code, {"error": {"message": "fake error", "status": "FAKE"}})
+
+        return genai_types.GenerateContentResponse(candidates=[genai_types.Candidate(
+            content=genai_types.Content(role="model", parts=[genai_types.Part(text=f"{stage} answer")]),
+            finish_reason="STOP",
+        )])
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    fake = FakeGemini()
+
+    async def generate_content(models_self, **kwargs):
+        return await fake.generate_content(models_self, **kwargs)
+
+    monkeypatch.setattr(genai_models.AsyncModels, "generate_content", generate_content)
+    monkeypatch.setattr(main, "llm_cache", LLMCache())
+    monkeypatch.setattr(main, "gemini_breaker", CircuitBreaker(fail_max=10, reset_timeout=30))
+    # no waiting between retries, in our retries or CrewAI's
+    monkeypatch.setattr(main, "wait_exponential_jitter", lambda **kwargs: wait_none())
+    monkeypatch.setattr(crewai.llms.retry, "get_retry_delay_seconds", lambda *args, **kwargs: 0)
+    return fake
+
+
+def test_study_material_runs_each_stage_once(gemini):
+    result = asyncio.run(main._generate_study_material(TEXT, 3))
+
+    assert result.topics == "topics answer"
+    assert gemini.calls == ["topics", "notes", "mcqs"]
+
+
+def test_persistent_rate_limit_on_crew_is_retried_by_one_layer(gemini):
+    gemini.fail("topics", 429)
+
+    with pytest.raises(genai_errors.ClientError):
+        asyncio.run(main._generate_study_material(TEXT, 3))
+
+    # CrewAI's own rate-limit retry (3 tries) only, not 3 per _call_gemini attempt
+    assert gemini.calls == ["topics"] * 3
+
+
+def test_persistent_rate_limit_on_direct_call_is_tried_five_times(gemini):
+    gemini.fail("direct", 429)
+
+    with pytest.raises(genai_errors.ClientError):
+        asyncio.run(main._generate_gemini("prompt", "system", 0.3))
+
+    assert gemini.calls == ["direct"] * 5
+
+
+def test_deadline_errors_are_not_retried(gemini):
+    gemini.fail("notes", 504)
+
+    with pytest.raises(genai_errors.ServerError):
+        asyncio.run(main._generate_study_material(TEXT, 3))
+
+    assert gemini.calls == ["topics", "notes"]
+    assert main.gemini_breaker._failures == 0
+
+
+def test_failure_at_notes_reruns_only_notes_and_mcqs(gemini):
+    gemini.fail("notes", 503, times=1)
+
+    result = asyncio.run(main._generate_study_material(TEXT, 3))
+
+    assert result.notes == "notes answer"
+    assert gemini.calls == ["topics", "notes", "notes", "mcqs"]
+
+
+def test_exhausted_retries_record_one_breaker_failure(gemini, monkeypatch):
+    gemini.fail("notes", 503)
+    failures = []
+    monkeypatch.setattr(main.gemini_breaker, "record_failure", lambda: failures.append(1))
+
+    with pytest.raises(genai_errors.ServerError):
+        asyncio.run(main._generate_study_material(TEXT, 3))
+
+    assert gemini.calls == ["topics"] + ["notes"] * 5
+    assert failures == [1]
+
+
+def test_admission_slots_are_released_after_a_failure(gemini):
+    gemini.fail("direct", 503)
+
+    with pytest.raises(genai_errors.ServerError):
+        asyncio.run(main._generate_gemini("prompt", "system", 0.3))
+
+    assert main.admission_stats == {"in_flight": 0, "waiting": 0}
+    assert main.gemini_admission._value == main.MAX_GEMINI_CONCURRENCY
+
+
+def test_open_breaker_refuses_without_calling_gemini(gemini):
+    for _ in range(main.gemini_breaker.fail_max):
+        main.gemini_breaker.record_failure()
+
+    with pytest.raises(main.CircuitOpenError):
+        asyncio.run(main._generate_gemini("prompt", "system", 0.3))
+
+    assert gemini.calls == []
+
+
+def test_crew_cache_key_depends_on_every_stage_temperature():
+    inputs = {"content": TEXT, "num_mcqs": 3}
+    crew = main._crews().study()
+    key = main._crew_cache_key(crew, inputs)
+
+    notes_agent = crew.tasks[1].agent
+    notes_agent.llm = notes_agent.llm.model_copy(update={"temperature": 0.9})
+
+    assert main._crew_cache_key(crew, inputs) != key
+    assert main._crew_cache_key(main._crews().study(), inputs) == key
+
+
+def test_streamed_mcqs_use_the_mcq_crew_persona_and_temperature(gemini):
+    asyncio.run(main._run_crew(main._crews().notes_mcq(), {"notes": "notes", "num_mcqs": 3}))
+    config = gemini.configs[-1]
+
+    assert config.system_instruction.parts[0].text == main._system_instruction(main.MCQ_MAKER)
+    assert config.temperature == main.MCQ_TEMPERATURE
+
+
+def test_failed_chunk_cancels_the_other_chunks(gemini, monkeypatch):
+    started, cancelled = [], []
+
+    async def generate_content(models_self, *, model, contents, config=None, **kwargs):
+        text = str(contents)
+        started.append(text)
+        if "BROKEN" in text:
+            raise genai_errors.ClientError(400, {"error": {"message": "bad chunk", "status": "INVALID"}})
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(text)
+            raise
+
+    monkeypatch.setattr(genai_models.AsyncModels, "generate_content", generate_content)
+    long_text = "\n\n".join([
+        "Stacks are last in, first out. " * 200,
+        "BROKEN " * 900,
+        "Queues are first in, first out. " * 200,
+    ])
+    monkeypatch.setattr(main, "MAX_CHARS", 7000)
+
+    async def run():
+        with pytest.raises(genai_errors.ClientError):
+            await asyncio.wait_for(main._long_topics_and_notes(long_text), timeout=10)
+        # checked before asyncio.run() cancels whatever is still running
+        assert len(started) == 3
+        assert len(cancelled) == 2
+        assert main.admission_stats == {"in_flight": 0, "waiting": 0}
+
+    asyncio.run(run())
@@ -0,0 +1,154 @@
+import httpx
+import pytest
+from google.genai import errors as genai_errors
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, is_transient_error
+
+
+def _genai_error(code: int) -> genai_errors.APIError:
+    cls = genai_errors.ServerError if code >= 500 else genai_errors.ClientError
+    return cls(code, {"error": {"message": "boom", "status": "X"}})
+
+
+def _http_status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://example.com")
+    response = httpx.Response(status, request=request)
+    return httpx.HTTPStatusError("boom", request=request, response=response)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"t": 1000.0}
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now["t"])
+    return now
+
+
+# ---------- is_transient_error ----------
+
+@pytest.mark.parametrize("code", [429, 500, 503])
+def test_genai_rate_limit_and_server_errors_are_transient(code):
+    assert is_transient_error(_genai_error(code))
+
+
+@pytest.mark.parametrize("code", [400, 403, 404])
+def test_genai_client_errors_are_not_transient(code):
+    assert not is_transient_error(_genai_error(code))
+
+
+@pytest.mark.parametrize("status, expected", [(429, True), (502, True), (400, False), (401, False)])
+def test_http_status_errors(status, expected):
+    assert is_transient_error(_http_status_error(status)) is expected
+
+
+def test_transport_errors_are_transient():
+    assert is_transient_error(httpx.ConnectError("refused"))
+    assert is_transient_error(httpx.ConnectTimeout("no answer"))
+    assert is_transient_error(httpx.RemoteProtocolError("dropped"))
+
+
+def test_timeouts_are_not_transient():
+    assert not is_transient_error(httpx.ReadTimeout("slow"))
+    assert not is_transient_error(_genai_error(504))
+    assert not is_transient_error(_http_status_error(504))
+
+
+def test_timeout_anywhere_in_the_chain_is_not_transient():
+    try:
+        try:
+            raise httpx.ReadTimeout("slow")
+        except Exception as e:
+            raise RuntimeError("wrapped by CrewAI") from e
+    except RuntimeError as wrapped:
+        assert not is_transient_error(wrapped)
+
+
+def test_other_errors_are_not_transient():
+    assert not is_transient_error(ValueError("bad input"))
+
+
+def test_walks_the_cause_chain():
+    try:
+        try:
+            raise _genai_error(503)
+        except Exception as e:
+            raise RuntimeError("wrapped by CrewAI") from e
+    except RuntimeError as wrapped:
+        assert is_transient_error(wrapped)
+
+
+def test_walks_the_context_chain():
+    try:
+        try:
+            raise httpx.ConnectError("refused")
+        except Exception:
+            raise RuntimeError("raised while handling")
+    except RuntimeError as wrapped:
+        assert is_transient_error(wrapped)
+
+
+def test_cyclic_chain_terminates():
+    a, b = ValueError("a"), ValueError("b")
+    a.__cause__, b.__cause__ = b, a
+    assert not is_transient_error(a)
+
+
+# ---------- CircuitBreaker ----------
+
+def test_breaker_opens_after_fail_max_failures(clock):
+    breaker = CircuitBreaker(fail_max=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.before_call()  # still closed
+
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(fail_max=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.before_call()  # 2 failures since the success - still closed
+
+
+def test_breaker_lets_calls_through_after_reset_timeout(clock):
+    breaker = CircuitBreaker(fail_max=1, reset_timeout=30)
+    breaker.record_failure()
+
+    clock["t"] += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock["t"] += 1
+    breaker.before_call()
+
+
+def test_half_open_failure_opens_again(clock):
+    breaker = CircuitBreaker(fail_max=3, reset_timeout=30)
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock["t"] += 30
+    breaker.before_call()  # half-open: one trial call
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_success_closes(clock):
+    breaker = CircuitBreaker(fail_max=3, reset_timeout=30)
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock["t"] += 30
+    breaker.before_call()
+    breaker.record_success()
+
+    breaker.record_failure()
+    breaker.before_call()  # needs fail_max new failures to open again